@@ -0,0 +1,122 @@
+"""
+Shared upstream API helpers for the Due Diligence Platform
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import hashlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.cache import cache_get, cache_set
+
+# Shared worker pool for fanning out independent upstream API calls
+EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# Calls one request may have in flight at once, so a large batch can't hold the whole pool
+MAX_WORKERS_PER_REQUEST = 4
+
+# Pooled keep-alive session reused for all FMP / Alpha Vantage calls
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=50,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# Cache lifetimes (seconds) per kind of upstream payload
+CACHE_TTLS = {
+    'profile': 24 * 60 * 60,
+    'financial_statements': 12 * 60 * 60,
+    'search': 60 * 60,
+    'news': 5 * 60
+}
+
+# Stale copies are kept longer and only served when the upstream fails
+STALE_TTL = 7 * 24 * 60 * 60
+
+def _cache_key(url):
+    """Build a cache key from the URL with the API key stripped"""
+    parts = urlsplit(url)
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != 'apikey'])
+    return 'ddapi:' + hashlib.sha1(urlunsplit(parts._replace(query=query)).encode()).hexdigest()
+
+def _cached_fetch(url, policy, timeout, parse):
+    """Return (body, payload) for a URL; payload is None when the body came from the cache
+
+    Without `parse`, only JSON array bodies are accepted (and cached).
+    """
+    key = _cache_key(url)
+
+    cached = cache_get(key)
+    if cached is not None:
+        return cached, None
+
+    try:
+        with SESSION.get(url, timeout=timeout, stream=parse is not None) as response:
+            response.raise_for_status()
+            if parse is not None:
+                payload = parse(response)
+                body = orjson.dumps(payload)
+            else:
+                body = response.content
+                try:
+                    payload = orjson.loads(body)
+                except orjson.JSONDecodeError as e:
+                    raise requests.exceptions.InvalidJSONError(f'Invalid JSON from upstream: {e}', response=response)
+                # FMP answers with a list; errors such as {"Error Message": ...} come back as HTTP 200 objects
+                if not isinstance(payload, list):
+                    raise requests.exceptions.RequestException(
+                        f'Unexpected payload from upstream: {body[:200].decode(errors="replace")}', response=response
+                    )
+    except requests.RequestException:
+        stale = cache_get(key + ':stale')
+        if stale is None:
+            raise
+        return stale, None
+
+    cache_set(key, body, CACHE_TTLS[policy])
+    cache_set(key + ':stale', body, STALE_TTL)
+    return body, payload
+
+def cached_get(url, policy, timeout=10, parse=None):
+    """GET a JSON payload through the cache, serving a stale copy if the upstream fails
+
+    When `parse` is given the body is streamed to it instead of being buffered,
+    and whatever it returns is what gets cached.
+    """
+    body, payload = _cached_fetch(url, policy, timeout, parse)
+    return orjson.loads(body) if payload is None else payload
+
+def cached_get_raw(url, policy, timeout=10):
+    """Like cached_get, but return the raw JSON body bytes without decoding them"""
+    return _cached_fetch(url, policy, timeout, None)[0]
+
+def _result_or_default(future, default):
+    """Return a fetch future's payload, or `default` if the call failed"""
+    try:
+        return future.result()
+    except requests.RequestException:
+        return default
+
+def fetch_all(calls, default=None):
+    """Fetch (url, policy) pairs concurrently, in order; failed calls yield `default`
+
+    At most MAX_WORKERS_PER_REQUEST calls are in flight at once; the rest are
+    submitted as earlier ones finish.
+    """
+    results = [default] * len(calls)
+    pending = {}  # future -> index into results
+
+    for index, (url, policy) in enumerate(calls):
+        if len(pending) >= MAX_WORKERS_PER_REQUEST:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = _result_or_default(future, default)
+        pending[EXECUTOR.submit(cached_get, url, policy)] = index
+
+    for future, index in pending.items():
+        results[index] = _result_or_default(future, default)
+    return results
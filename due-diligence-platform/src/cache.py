@@ -0,0 +1,63 @@
+"""
+Redis cache helpers for the Due Diligence Platform
+"""
+import os
+import time
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Load environment variables
+load_dotenv()
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Seconds to wait on Redis before treating a call as failed, so a hung server can't stall requests
+REDIS_TIMEOUT = 0.5
+
+# Failure warnings are printed at most this often, so an outage doesn't log on every request
+REDIS_WARNING_INTERVAL = 30
+
+# Redis is optional: without it every lookup is treated as a miss
+if redis is not None and REDIS_URL:
+    redis_client = redis.Redis.from_url(
+        REDIS_URL,
+        socket_timeout=REDIS_TIMEOUT,
+        socket_connect_timeout=REDIS_TIMEOUT
+    )
+else:
+    redis_client = None
+
+_last_redis_warning = None
+
+def redis_warning(message):
+    """Print a Redis failure warning, at most once per REDIS_WARNING_INTERVAL seconds"""
+    global _last_redis_warning
+    now = time.monotonic()
+    if _last_redis_warning is None or now - _last_redis_warning >= REDIS_WARNING_INTERVAL:
+        _last_redis_warning = now
+        print(f"Warning: {message}")
+
+def cache_get(key):
+    """Return the cached bytes for a key, or None on a miss or cache failure"""
+    if redis_client is None:
+        return None
+
+    try:
+        return redis_client.get(key)
+    except redis.RedisError as e:
+        redis_warning(f"Redis cache read failed: {e}")
+        return None
+
+def cache_set(key, value, ttl):
+    """Store bytes under a key with a TTL in seconds, ignoring cache failures"""
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.setex(key, ttl, value)
+    except redis.RedisError as e:
+        redis_warning(f"Redis cache write failed: {e}")
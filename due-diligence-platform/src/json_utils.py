@@ -0,0 +1,20 @@
+"""
+JSON serialization utilities for the Due Diligence Platform
+"""
+import orjson
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        # Formatting options such as indent/sort_keys are ignored; orjson output is always compact
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def json_response(obj, status=200):
+    """Serialize straight to a JSON response, skipping the jsonify/provider indirection"""
+    return Response(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), status=status, mimetype='application/json')
@@ -4,11 +4,13 @@ import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from flask import Flask, send_from_directory
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 from dotenv import load_dotenv
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.due_diligence import due_diligence_bp
+from src.json_utils import ORJSONProvider
 
 # Load environment variables
 load_dotenv()
@@ -16,6 +18,15 @@ load_dotenv()
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'asdf#FGSgvasgf$5$WGT')
 
+# Behind reverse proxies, take the client IP from X-Forwarded-For only as far as the
+# trusted proxy count allows (0 = not behind a proxy, ignore the header)
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '0'))
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+
+# Serialize JSON responses with orjson
+app.json = ORJSONProvider(app)
+
 # Enable CORS for all routes
 CORS(app)
 
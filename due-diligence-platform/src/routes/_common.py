@@ -0,0 +1,325 @@
+"""
+Shared due diligence routes used by both the AI and simplified blueprints
+"""
+from flask import Blueprint, jsonify
+from flask_cors import cross_origin
+import os
+import requests
+from dotenv import load_dotenv
+import orjson
+from functools import lru_cache
+import ijson
+import urllib3
+from src.security import security_manager, require_valid_input, validate_symbol_input, get_clean, get_request_data
+from src.api_client import cached_get, cached_get_raw, fetch_all
+from src.json_utils import json_response
+
+# Load environment variables
+load_dotenv()
+
+# API Keys
+ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
+FMP_API_KEY = os.getenv('FMP_API_KEY')
+
+# Upstream URL templates, with the API keys baked in once at import
+_FMP_KEY = "apikey=" + str(FMP_API_KEY)
+URL_SEARCH = "https://financialmodelingprep.com/api/v3/search?query={query}&" + _FMP_KEY
+URL_PROFILE = "https://financialmodelingprep.com/api/v3/profile/{symbol}?" + _FMP_KEY
+URL_INCOME_STATEMENT = "https://financialmodelingprep.com/api/v3/income-statement/{symbol}?limit={limit}&" + _FMP_KEY
+URL_BALANCE_SHEET = "https://financialmodelingprep.com/api/v3/balance-sheet-statement/{symbol}?limit={limit}&" + _FMP_KEY
+URL_CASH_FLOW = "https://financialmodelingprep.com/api/v3/cash-flow-statement/{symbol}?limit={limit}&" + _FMP_KEY
+URL_NEWS = "https://www.alphavantage.co/query?function=NEWS_SENTIMENT&tickers={symbol}&apikey=" + str(ALPHA_VANTAGE_API_KEY)
+STATEMENT_URLS = (
+    ('income_statement', URL_INCOME_STATEMENT),
+    ('balance_sheet', URL_BALANCE_SHEET),
+    ('cash_flow', URL_CASH_FLOW)
+)
+
+# Sanitization rules (max_length, allow_special_chars) for upstream text fields
+SEARCH_RESULT_SCHEMA = {
+    'symbol': (10, False),
+    'name': (200, True),
+    'currency': (10, False),
+    'stockExchange': (50, True),
+    'exchangeShortName': (20, False)
+}
+PROFILE_SCHEMA = {
+    'symbol': (10, False),
+    'companyName': (200, True),
+    'sector': (100, True),
+    'industry': (100, True),
+    'description': (2000, True),
+    'website': (200, True),
+    'country': (50, False),
+    'currency': (10, False)
+}
+
+ANALYSIS_TYPES = ('general', 'financial', 'risk')
+
+# Number of articles returned by the market news endpoint
+NEWS_FEED_LIMIT = 20
+
+# Keys Alpha Vantage uses for throttling and error notices in place of a feed
+NEWS_NOTICE_KEYS = ('Information', 'Note', 'Error Message')
+
+# Upper bound on symbols accepted by the batch analysis endpoint
+MAX_BATCH_SYMBOLS = 50
+
+NUMERIC_TYPES = (int, float)
+
+def _num(value):
+    """Return value if it is numeric, otherwise None"""
+    return value if isinstance(value, NUMERIC_TYPES) else None
+
+def fmt_number(value):
+    """Format a number with thousands separators, or 'N/A' if it isn't numeric"""
+    return f"{value:,}" if isinstance(value, NUMERIC_TYPES) else 'N/A'
+
+def fmt_money(value):
+    """Format a dollar amount with thousands separators, or 'N/A' if it isn't numeric"""
+    return f"${value:,}" if isinstance(value, NUMERIC_TYPES) else 'N/A'
+
+def _watch_top_level(events, top_level):
+    """Pass parse events through, recording top-level keys and their string values"""
+    for prefix, event, value in events:
+        if prefix == '' and event == 'map_key':
+            top_level.setdefault(value, None)
+        elif event == 'string' and prefix in top_level:
+            top_level[prefix] = value
+        yield prefix, event, value
+
+def _parse_news_feed(response):
+    """Stream the Alpha Vantage news feed into a trimmed, sanitized article list"""
+    response.raw.decode_content = True
+    
+    feed = []
+    top_level = {}
+    try:
+        events = _watch_top_level(ijson.parse(response.raw, use_float=True), top_level)
+        for article in ijson.items(events, 'feed.item'):
+            feed.append({
+                'title': security_manager.validate_input(article.get('title', ''), 300),
+                'url': security_manager.validate_input(article.get('url', ''), 500),
+                'time_published': security_manager.validate_input(article.get('time_published', ''), 20, False),
+                'source': security_manager.validate_input(article.get('source', ''), 100),
+                'summary': security_manager.validate_input(article.get('summary', ''), 1000),
+                'overall_sentiment_score': _num(article.get('overall_sentiment_score')),
+                'overall_sentiment_label': security_manager.validate_input(article.get('overall_sentiment_label', ''), 30, False)
+            })
+            if len(feed) >= NEWS_FEED_LIMIT:
+                break
+    except (ijson.JSONError, urllib3.exceptions.HTTPError) as e:
+        raise requests.exceptions.InvalidJSONError(f'Invalid news feed from upstream: {e}')
+    
+    # Throttling and error notices come back as HTTP 200 without a feed; fail so they aren't cached
+    if 'feed' not in top_level:
+        notice = next((top_level[key] for key in NEWS_NOTICE_KEYS if top_level.get(key)), 'no feed in response')
+        raise requests.exceptions.RequestException(f'Alpha Vantage news unavailable: {notice}')
+    
+    return {'feed': feed}
+
+@lru_cache(maxsize=4096)
+def _sanitize_profile(raw_profile):
+    """Sanitize a raw FMP profile response, memoized on the response bytes"""
+    profile_data = orjson.loads(raw_profile)
+    if not profile_data:
+        return None
+    
+    profile = profile_data[0]
+    safe_profile = security_manager.validate_batch([profile], PROFILE_SCHEMA)[0]
+    safe_profile.update({
+        'mktCap': _num(profile.get('mktCap')),
+        'price': _num(profile.get('price')),
+        'fullTimeEmployees': _num(profile.get('fullTimeEmployees'))
+    })
+    return safe_profile
+
+def fetch_companies_data(symbols):
+    """Fetch profile and latest income statements for many symbols concurrently"""
+    calls = []
+    for symbol in symbols:
+        calls.append((URL_PROFILE.format(symbol=symbol), 'profile'))
+        calls.append((URL_INCOME_STATEMENT.format(symbol=symbol, limit=2), 'financial_statements'))
+    results = fetch_all(calls)
+    
+    # Continue without whichever part failed; drop symbols with no data at all
+    companies = {}
+    for symbol, profile_data, income_data in zip(symbols, results[::2], results[1::2]):
+        company_data = {}
+        if profile_data:
+            company_data['profile'] = profile_data[0]
+        if income_data is not None:
+            company_data['income_statement'] = income_data
+        if company_data:
+            companies[symbol] = company_data
+    return companies
+
+def fetch_company_data(symbol):
+    """Fetch profile and latest income statements for one symbol"""
+    return fetch_companies_data([symbol]).get(symbol, {})
+
+def parse_batch_request():
+    """Validate a batch analysis request body
+    
+    Returns (symbols, analysis_type, None) on success or (None, None, error_response).
+    """
+    data = get_request_data()
+    symbols = data.get('symbols')
+    analysis_type = security_manager.validate_input(
+        data.get('analysis_type', 'general'), 20, False
+    )
+    
+    if not isinstance(symbols, list) or not symbols:
+        return None, None, (jsonify({'error': 'symbols must be a non-empty list'}), 400)
+    
+    if len(symbols) > MAX_BATCH_SYMBOLS:
+        return None, None, (jsonify({'error': f'At most {MAX_BATCH_SYMBOLS} symbols per request'}), 400)
+    
+    if not all(isinstance(symbol, str) and security_manager.validate_symbol(symbol) for symbol in symbols):
+        security_manager.log_security_event('INVALID_SYMBOL', 'Invalid symbol format in batch request')
+        return None, None, (jsonify({'error': 'Invalid symbol format'}), 400)
+    
+    if analysis_type not in ANALYSIS_TYPES:
+        return None, None, (jsonify({'error': 'Invalid analysis type'}), 400)
+    
+    return list(dict.fromkeys(symbols)), analysis_type, None  # Drop duplicates, keep order
+
+def make_blueprint(enable_ai):
+    """Create the due diligence blueprint with the routes shared by every variant"""
+    bp = Blueprint('due_diligence', __name__)
+    
+    @bp.route('/search-company', methods=['POST'])
+    @cross_origin()
+    @security_manager.rate_limit(max_requests=20, window_minutes=1)
+    @require_valid_input('query', max_length=100, allow_special_chars=False)
+    def search_company():
+        """Search for company information by symbol or name"""
+        try:
+            query = get_clean('query', '')
+            
+            if not query:
+                return jsonify({'error': 'Query parameter is required'}), 400
+            
+            # Validate API key
+            is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
+            if not is_valid:
+                return jsonify({'error': message}), 500
+            
+            # Search using FMP API
+            search_url = URL_SEARCH.format(query=query)
+            
+            try:
+                companies = cached_get(search_url, 'search')
+            except requests.RequestException as e:
+                security_manager.log_security_event('API_ERROR', f'FMP search failed: {str(e)}')
+                return jsonify({'error': 'External API temporarily unavailable'}), 503
+            
+            # Limit to top 10 results and sanitize them
+            safe_companies = security_manager.validate_batch(companies[:10], SEARCH_RESULT_SCHEMA)
+            
+            return jsonify({'companies': safe_companies})
+        
+        except Exception as e:
+            security_manager.log_security_event('SEARCH_ERROR', f'Unexpected error: {str(e)}')
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @bp.route('/company-profile/<symbol>', methods=['GET'])
+    @cross_origin()
+    @security_manager.rate_limit(max_requests=30, window_minutes=1)
+    @validate_symbol_input
+    def get_company_profile(symbol):
+        """Get detailed company profile"""
+        try:
+            # Validate API key
+            is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
+            if not is_valid:
+                return jsonify({'error': message}), 500
+            
+            # Get company profile from FMP
+            profile_url = URL_PROFILE.format(symbol=symbol)
+            
+            try:
+                raw_profile = cached_get_raw(profile_url, 'profile')
+            except requests.RequestException as e:
+                security_manager.log_security_event('API_ERROR', f'FMP profile failed: {str(e)}')
+                return jsonify({'error': 'External API temporarily unavailable'}), 503
+            
+            safe_profile = _sanitize_profile(raw_profile)
+            if safe_profile:
+                return jsonify({'profile': safe_profile})
+            else:
+                return jsonify({'error': 'Company not found'}), 404
+        
+        except Exception as e:
+            security_manager.log_security_event('PROFILE_ERROR', f'Unexpected error: {str(e)}')
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @bp.route('/financial-statements/<symbol>', methods=['GET'])
+    @cross_origin()
+    @security_manager.rate_limit(max_requests=20, window_minutes=1)
+    @validate_symbol_input
+    def get_financial_statements(symbol):
+        """Get financial statements for a company"""
+        try:
+            # Validate API key
+            is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
+            if not is_valid:
+                return jsonify({'error': message}), 500
+            
+            statements = {}
+            
+            # Income statement, balance sheet and cash flow are fetched concurrently
+            results = fetch_all(
+                [(url.format(symbol=symbol, limit=5), 'financial_statements') for _, url in STATEMENT_URLS], default=[]
+            )
+            for (key, _), result in zip(STATEMENT_URLS, results):
+                statements[key] = result
+            
+            return json_response({'financial_statements': statements})
+        
+        except Exception as e:
+            security_manager.log_security_event('FINANCIAL_ERROR', f'Unexpected error: {str(e)}')
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @bp.route('/market-news/<symbol>', methods=['GET'])
+    @cross_origin()
+    @security_manager.rate_limit(max_requests=15, window_minutes=1)
+    @validate_symbol_input
+    def get_market_news(symbol):
+        """Get market news for a company"""
+        try:
+            # Validate API key
+            is_valid, message = security_manager.validate_api_key(ALPHA_VANTAGE_API_KEY, 'Alpha Vantage')
+            if not is_valid:
+                return jsonify({'error': message}), 500
+            
+            # Get news from Alpha Vantage
+            news_url = URL_NEWS.format(symbol=symbol)
+            
+            try:
+                news_data = cached_get(news_url, 'news', timeout=15, parse=_parse_news_feed)
+            except requests.RequestException as e:
+                security_manager.log_security_event('API_ERROR', f'Alpha Vantage news failed: {str(e)}')
+                return jsonify({'error': 'News service temporarily unavailable'}), 503
+            
+            return json_response({'news': news_data})
+        
+        except Exception as e:
+            security_manager.log_security_event('NEWS_ERROR', f'Unexpected error: {str(e)}')
+            return jsonify({'error': 'Internal server error'}), 500
+    
+    @bp.route('/health', methods=['GET'])
+    @cross_origin()
+    def health_check():
+        """Health check endpoint"""
+        status = {
+            'status': 'healthy',
+            'service': 'due-diligence-api',
+            'security': 'enabled'
+        }
+        if not enable_ai:
+            status['version'] = 'simplified'
+        return jsonify(status)
+    
+    return bp
@@ -1,312 +1,206 @@
-from flask import Blueprint, jsonify, request
+from flask import jsonify
 from flask_cors import cross_origin
 import os
-import requests
-from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
-import json
-from src.security import security_manager, require_valid_input, validate_symbol_input
+import hashlib
+import orjson
+from src.json_utils import json_response
+from src.security import security_manager, require_valid_input, get_clean, get_request_data
+from src.cache import cache_get, cache_set
+from src.routes._common import (
+    FMP_API_KEY, make_blueprint, fetch_company_data, fetch_companies_data,
+    parse_batch_request, fmt_money
+)
 
-# Load environment variables
-load_dotenv()
+due_diligence_bp = make_blueprint(enable_ai=True)
 
-due_diligence_bp = Blueprint('due_diligence', __name__)
+# Gemini model settings (also part of the analysis cache key)
+GEMINI_MODEL = "gemini-1.5-flash"
+GEMINI_TEMPERATURE = 0.6
 
 # Initialize Gemini LLM
 try:
     llm = ChatGoogleGenerativeAI(
-        model="gemini-1.5-flash",
+        model=GEMINI_MODEL,
         google_api_key=os.getenv('GOOGLE_API_KEY'),
-        temperature=0.6
+        temperature=GEMINI_TEMPERATURE
     )
 except Exception as e:
     print(f"Warning: Failed to initialize Gemini LLM: {e}")
     llm = None
 
-# API Keys
-ALPHA_VANTAGE_API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
-FINNHUB_API_KEY = os.getenv('FINNHUB_API_KEY')
-FMP_API_KEY = os.getenv('FMP_API_KEY')
+# Analysis cache: 'read-only' never writes, 'replay' never calls Gemini on a miss
+LLM_CACHE_TTL = 6 * 60 * 60
+CACHE_POLICIES = ('enabled', 'read-only', 'replay', 'disabled')
+llm_cache_stats = {'hits': 0, 'misses': 0}
 
-@due_diligence_bp.route('/search-company', methods=['POST'])
-@cross_origin()
-@security_manager.rate_limit(max_requests=20, window_minutes=1)
-@require_valid_input('query', max_length=100, allow_special_chars=False)
-def search_company():
-    """Search for company information by symbol or name"""
-    try:
-        data = request.json
-        query = data.get('query', '').strip()
-        
-        if not query:
-            return jsonify({'error': 'Query parameter is required'}), 400
-        
-        # Validate API key
-        is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
-        if not is_valid:
-            return jsonify({'error': message}), 500
-        
-        # Search using FMP API
-        search_url = f"https://financialmodelingprep.com/api/v3/search?query={query}&apikey={FMP_API_KEY}"
-        
-        try:
-            response = requests.get(search_url, timeout=10)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            security_manager.log_security_event('API_ERROR', f'FMP search failed: {str(e)}')
-            return jsonify({'error': 'External API temporarily unavailable'}), 503
-        
-        if response.status_code == 200:
-            companies = response.json()
-            # Limit and sanitize results
-            safe_companies = []
-            for company in companies[:10]:  # Limit to top 10 results
-                safe_company = {
-                    'symbol': security_manager.validate_input(company.get('symbol', ''), 10, False),
-                    'name': security_manager.validate_input(company.get('name', ''), 200),
-                    'currency': security_manager.validate_input(company.get('currency', ''), 10, False),
-                    'stockExchange': security_manager.validate_input(company.get('stockExchange', ''), 50),
-                    'exchangeShortName': security_manager.validate_input(company.get('exchangeShortName', ''), 20, False)
-                }
-                safe_companies.append(safe_company)
+# System prompts for each analysis type, built once at import
+SYSTEM_PROMPTS = {
+    'financial': SystemMessage(content="""You are a financial analyst conducting due diligence for a potential acquisition. 
+            Analyze the provided company data and provide insights on:
+            1. Financial health and performance trends
+            2. Revenue growth and profitability
+            3. Key financial ratios and metrics
+            4. Potential financial risks
+            5. Investment attractiveness
             
-            return jsonify({'companies': safe_companies})
-        else:
-            return jsonify({'error': 'Failed to search companies'}), 500
+            Provide a structured analysis with clear sections and actionable insights. Keep the analysis professional and objective."""),
+    'risk': SystemMessage(content="""You are a risk analyst conducting due diligence for a potential acquisition.
+            Analyze the provided company data and identify:
+            1. Business and operational risks
+            2. Financial risks and red flags
+            3. Market and competitive risks
+            4. Regulatory and compliance risks
+            5. Risk mitigation recommendations
             
-    except Exception as e:
-        security_manager.log_security_event('SEARCH_ERROR', f'Unexpected error: {str(e)}')
-        return jsonify({'error': 'Internal server error'}), 500
+            Provide a comprehensive risk assessment with severity levels. Be thorough but concise."""),
+    'general': SystemMessage(content="""You are a senior M&A analyst conducting comprehensive due diligence.
+            Analyze the provided company data and provide:
+            1. Executive summary of the company
+            2. Key strengths and competitive advantages
+            3. Areas of concern or weakness
+            4. Market position and growth prospects
+            5. Overall acquisition recommendation
+            
+            Provide a balanced and thorough analysis suitable for investment decision-making. Be professional and objective.""")
+}
 
-@due_diligence_bp.route('/company-profile/<symbol>', methods=['GET'])
-@cross_origin()
-@security_manager.rate_limit(max_requests=30, window_minutes=1)
-@validate_symbol_input
-def get_company_profile(symbol):
-    """Get detailed company profile"""
-    try:
-        # Validate API key
-        is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
-        if not is_valid:
-            return jsonify({'error': message}), 500
-        
-        # Get company profile from FMP
-        profile_url = f"https://financialmodelingprep.com/api/v3/profile/{symbol}?apikey={FMP_API_KEY}"
-        
-        try:
-            response = requests.get(profile_url, timeout=10)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            security_manager.log_security_event('API_ERROR', f'FMP profile failed: {str(e)}')
-            return jsonify({'error': 'External API temporarily unavailable'}), 503
-        
-        if response.status_code == 200:
-            profile_data = response.json()
-            if profile_data:
-                # Sanitize profile data
-                profile = profile_data[0]
-                safe_profile = {
-                    'symbol': security_manager.validate_input(profile.get('symbol', ''), 10, False),
-                    'companyName': security_manager.validate_input(profile.get('companyName', ''), 200),
-                    'sector': security_manager.validate_input(profile.get('sector', ''), 100),
-                    'industry': security_manager.validate_input(profile.get('industry', ''), 100),
-                    'description': security_manager.validate_input(profile.get('description', ''), 2000),
-                    'mktCap': profile.get('mktCap') if isinstance(profile.get('mktCap'), (int, float)) else None,
-                    'price': profile.get('price') if isinstance(profile.get('price'), (int, float)) else None,
-                    'fullTimeEmployees': profile.get('fullTimeEmployees') if isinstance(profile.get('fullTimeEmployees'), (int, float)) else None,
-                    'website': security_manager.validate_input(profile.get('website', ''), 200),
-                    'country': security_manager.validate_input(profile.get('country', ''), 50, False),
-                    'currency': security_manager.validate_input(profile.get('currency', ''), 10, False)
-                }
-                return jsonify({'profile': safe_profile})
-            else:
-                return jsonify({'error': 'Company not found'}), 404
-        else:
-            return jsonify({'error': 'Failed to fetch company profile'}), 500
+# Batch analysis asks Gemini for one structured answer covering every symbol
+BATCH_ANALYSIS_FOCUS = {
+    'general': 'strengths, concerns, market position and an overall acquisition recommendation',
+    'financial': 'financial health, revenue growth, profitability and key financial risks',
+    'risk': 'business, financial, market and regulatory risks with severity levels'
+}
+BATCH_SYSTEM_PROMPT = """You are a senior M&A analyst conducting due diligence on a portfolio of potential acquisitions.
+            Each company's data is given under a "### SYMBOL" heading. For every company, write a concise,
+            professional and objective analysis covering {focus}.
             
-    except Exception as e:
-        security_manager.log_security_event('PROFILE_ERROR', f'Unexpected error: {str(e)}')
-        return jsonify({'error': 'Internal server error'}), 500
+            Respond only with a JSON array, one object per company, in the form
+            [{{"symbol": "SYMBOL", "analysis": "analysis text"}}] with no other text."""
+BATCH_SYSTEM_PROMPTS = {
+    analysis_type: SystemMessage(content=BATCH_SYSTEM_PROMPT.format(focus=focus))
+    for analysis_type, focus in BATCH_ANALYSIS_FOCUS.items()
+}
 
-@due_diligence_bp.route('/financial-statements/<symbol>', methods=['GET'])
-@cross_origin()
-@security_manager.rate_limit(max_requests=20, window_minutes=1)
-@validate_symbol_input
-def get_financial_statements(symbol):
-    """Get financial statements for a company"""
-    try:
-        # Validate API key
-        is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
-        if not is_valid:
-            return jsonify({'error': message}), 500
-        
-        statements = {}
-        
-        # Income Statement
-        income_url = f"https://financialmodelingprep.com/api/v3/income-statement/{symbol}?limit=5&apikey={FMP_API_KEY}"
-        try:
-            income_response = requests.get(income_url, timeout=10)
-            if income_response.status_code == 200:
-                statements['income_statement'] = income_response.json()
-        except requests.RequestException:
-            statements['income_statement'] = []
-        
-        # Balance Sheet
-        balance_url = f"https://financialmodelingprep.com/api/v3/balance-sheet-statement/{symbol}?limit=5&apikey={FMP_API_KEY}"
-        try:
-            balance_response = requests.get(balance_url, timeout=10)
-            if balance_response.status_code == 200:
-                statements['balance_sheet'] = balance_response.json()
-        except requests.RequestException:
-            statements['balance_sheet'] = []
-        
-        # Cash Flow Statement
-        cashflow_url = f"https://financialmodelingprep.com/api/v3/cash-flow-statement/{symbol}?limit=5&apikey={FMP_API_KEY}"
-        try:
-            cashflow_response = requests.get(cashflow_url, timeout=10)
-            if cashflow_response.status_code == 200:
-                statements['cash_flow'] = cashflow_response.json()
-        except requests.RequestException:
-            statements['cash_flow'] = []
-        
-        return jsonify({'financial_statements': statements})
-        
-    except Exception as e:
-        security_manager.log_security_event('FINANCIAL_ERROR', f'Unexpected error: {str(e)}')
-        return jsonify({'error': 'Internal server error'}), 500
+# Company data summary sent to Gemini; text fields are sanitized before formatting
+_SUMMARY_TMPL = (
+    "Company: {name}\n"
+    "Sector: {sector}\n"
+    "Industry: {industry}\n"
+    "Market Cap: {market_cap}\n"
+    "Description: {description}...\n"
+    "\n"
+    "Recent Financial Data:\n"
+    "{financials}\n"
+)
 
-@due_diligence_bp.route('/market-news/<symbol>', methods=['GET'])
-@cross_origin()
-@security_manager.rate_limit(max_requests=15, window_minutes=1)
-@validate_symbol_input
-def get_market_news(symbol):
-    """Get market news for a company"""
-    try:
-        # Validate API key
-        is_valid, message = security_manager.validate_api_key(ALPHA_VANTAGE_API_KEY, 'Alpha Vantage')
-        if not is_valid:
-            return jsonify({'error': message}), 500
-        
-        # Get news from Alpha Vantage
-        news_url = f"https://www.alphavantage.co/query?function=NEWS_SENTIMENT&tickers={symbol}&apikey={ALPHA_VANTAGE_API_KEY}"
-        
-        try:
-            response = requests.get(news_url, timeout=15)
-            response.raise_for_status()
-        except requests.RequestException as e:
-            security_manager.log_security_event('API_ERROR', f'Alpha Vantage news failed: {str(e)}')
-            return jsonify({'error': 'News service temporarily unavailable'}), 503
-        
-        if response.status_code == 200:
-            news_data = response.json()
-            return jsonify({'news': news_data})
-        else:
-            return jsonify({'error': 'Failed to fetch news'}), 500
-            
-    except Exception as e:
-        security_manager.log_security_event('NEWS_ERROR', f'Unexpected error: {str(e)}')
-        return jsonify({'error': 'Internal server error'}), 500
+def _ai_unavailable():
+    """Reject AI requests up front when Gemini isn't configured"""
+    return jsonify({'error': 'AI analysis service not available'}), 503
+
+def ai_route(rule, **options):
+    """Register an AI-backed route, or a bare 503 handler in its place when Gemini isn't configured"""
+    def decorator(f):
+        view_func = f if llm is not None else cross_origin()(_ai_unavailable)
+        due_diligence_bp.add_url_rule(rule, f.__name__, view_func, **options)
+        return f
+    return decorator
+
+def _build_data_summary(symbol, company_data):
+    """Build the sanitized company data summary sent to Gemini"""
+    profile = company_data.get('profile', {})
+    income_statements = company_data.get('income_statement')
+    return _SUMMARY_TMPL.format(
+        name=security_manager.validate_input(profile.get('companyName', symbol), 200),
+        sector=security_manager.validate_input(profile.get('sector', 'N/A'), 100),
+        industry=security_manager.validate_input(profile.get('industry', 'N/A'), 100),
+        market_cap=fmt_money(profile.get('mktCap')),
+        description=security_manager.validate_input(profile.get('description', 'N/A'), 500),
+        # Gemini doesn't need pretty-printed JSON
+        financials=orjson.dumps(income_statements[:2]).decode() if income_statements else 'No financial data available'
+    )
 
-@due_diligence_bp.route('/analyze-company', methods=['POST'])
+def _parse_batch_analysis(content, symbols):
+    """Map symbols to sanitized analyses from a batch response's JSON array
+    
+    Raises ValueError if the response doesn't contain a JSON array.
+    """
+    # Skip any prose or code fence around the array
+    start, end = content.find('['), content.rfind(']')
+    items = orjson.loads(content[start:end + 1] if 0 <= start < end else content)
+    if not isinstance(items, list):
+        raise ValueError('Batch analysis response is not a JSON array')
+    
+    analyses = {}
+    for item in items:
+        if isinstance(item, dict) and item.get('symbol') in symbols:
+            analyses[item['symbol']] = security_manager.validate_input(str(item.get('analysis', '')), 10000)
+    return analyses
+
+@ai_route('/analyze-company', methods=['POST'])
 @cross_origin()
 @security_manager.rate_limit(max_requests=5, window_minutes=1)  # Lower limit for AI analysis
 @require_valid_input('symbol', max_length=10, allow_special_chars=False)
 def analyze_company():
     """Analyze company data using Gemini AI"""
     try:
-        if not llm:
-            return jsonify({'error': 'AI analysis service not available'}), 503
-        
-        data = request.json
-        symbol = data.get('symbol')
+        data = get_request_data()
+        symbol = get_clean('symbol')
         analysis_type = security_manager.validate_input(
             data.get('analysis_type', 'general'), 20, False
         )
         
-        if analysis_type not in ['general', 'financial', 'risk']:
+        if analysis_type not in SYSTEM_PROMPTS:
             return jsonify({'error': 'Invalid analysis type'}), 400
         
+        cache_policy = security_manager.validate_input(
+            data.get('cache_policy', 'enabled'), 20, False
+        )
+        
+        if cache_policy not in CACHE_POLICIES:
+            return jsonify({'error': 'Invalid cache policy'}), 400
+        
         # Validate API keys
         is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
         if not is_valid:
             return jsonify({'error': message}), 500
         
         # Gather company data with error handling
-        company_data = {}
-        
-        # Get company profile
-        try:
-            profile_url = f"https://financialmodelingprep.com/api/v3/profile/{symbol}?apikey={FMP_API_KEY}"
-            profile_response = requests.get(profile_url, timeout=10)
-            if profile_response.status_code == 200:
-                profile_data = profile_response.json()
-                if profile_data:
-                    company_data['profile'] = profile_data[0]
-        except requests.RequestException:
-            pass  # Continue without profile data
-        
-        # Get latest financial statements
-        try:
-            income_url = f"https://financialmodelingprep.com/api/v3/income-statement/{symbol}?limit=2&apikey={FMP_API_KEY}"
-            income_response = requests.get(income_url, timeout=10)
-            if income_response.status_code == 200:
-                company_data['income_statement'] = income_response.json()
-        except requests.RequestException:
-            pass  # Continue without financial data
+        company_data = fetch_company_data(symbol)
         
         if not company_data:
             return jsonify({'error': 'Unable to fetch company data'}), 404
         
-        # Create analysis prompt based on type
-        if analysis_type == 'financial':
-            system_prompt = """You are a financial analyst conducting due diligence for a potential acquisition. 
-            Analyze the provided company data and provide insights on:
-            1. Financial health and performance trends
-            2. Revenue growth and profitability
-            3. Key financial ratios and metrics
-            4. Potential financial risks
-            5. Investment attractiveness
-            
-            Provide a structured analysis with clear sections and actionable insights. Keep the analysis professional and objective."""
-        elif analysis_type == 'risk':
-            system_prompt = """You are a risk analyst conducting due diligence for a potential acquisition.
-            Analyze the provided company data and identify:
-            1. Business and operational risks
-            2. Financial risks and red flags
-            3. Market and competitive risks
-            4. Regulatory and compliance risks
-            5. Risk mitigation recommendations
-            
-            Provide a comprehensive risk assessment with severity levels. Be thorough but concise."""
-        else:
-            system_prompt = """You are a senior M&A analyst conducting comprehensive due diligence.
-            Analyze the provided company data and provide:
-            1. Executive summary of the company
-            2. Key strengths and competitive advantages
-            3. Areas of concern or weakness
-            4. Market position and growth prospects
-            5. Overall acquisition recommendation
-            
-            Provide a balanced and thorough analysis suitable for investment decision-making. Be professional and objective."""
-        
         # Prepare data for analysis (sanitized)
-        profile = company_data.get('profile', {})
-        data_summary = f"""
-        Company: {security_manager.validate_input(profile.get('companyName', symbol), 200)}
-        Sector: {security_manager.validate_input(profile.get('sector', 'N/A'), 100)}
-        Industry: {security_manager.validate_input(profile.get('industry', 'N/A'), 100)}
-        Market Cap: ${profile.get('mktCap', 'N/A'):,} if isinstance(profile.get('mktCap'), (int, float)) else 'N/A'
-        Description: {security_manager.validate_input(profile.get('description', 'N/A'), 500)}...
+        data_summary = _build_data_summary(symbol, company_data)
         
-        Recent Financial Data:
-        {json.dumps(company_data.get('income_statement', [])[:2], indent=2) if company_data.get('income_statement') else 'No financial data available'}
-        """
+        # Reuse a previous analysis of identical inputs when the cache policy allows it
+        cache_key = 'ddapi:llm:' + hashlib.sha256(
+            f"{symbol}|{analysis_type}|{GEMINI_MODEL}|{GEMINI_TEMPERATURE}|{data_summary}".encode()
+        ).hexdigest()
+        
+        cache_status = 'bypass'
+        if cache_policy != 'disabled':
+            cached_analysis = cache_get(cache_key)
+            if cached_analysis is not None:
+                llm_cache_stats['hits'] += 1
+                return json_response({
+                    'analysis': cached_analysis.decode(),
+                    'company_data': company_data,
+                    'analysis_type': analysis_type,
+                    'cache': dict(llm_cache_stats, status='hit')
+                })
+            
+            llm_cache_stats['misses'] += 1
+            cache_status = 'miss'
+            if cache_policy == 'replay':
+                return jsonify({'error': 'No cached analysis available for replay'}), 404
         
         # Generate analysis using Gemini
         try:
             messages = [
-                SystemMessage(content=system_prompt),
+                SYSTEM_PROMPTS[analysis_type],
                 HumanMessage(content=f"Please analyze the following company data:\n\n{data_summary}")
             ]
             
@@ -316,10 +210,14 @@ def analyze_company():
             # Sanitize the analysis output
             analysis = security_manager.validate_input(analysis, 10000)
             
-            return jsonify({
+            if cache_policy == 'enabled':
+                cache_set(cache_key, analysis.encode(), LLM_CACHE_TTL)
+            
+            return json_response({
                 'analysis': analysis,
                 'company_data': company_data,
-                'analysis_type': analysis_type
+                'analysis_type': analysis_type,
+                'cache': dict(llm_cache_stats, status=cache_status)
             })
         except Exception as e:
             security_manager.log_security_event('AI_ERROR', f'Gemini analysis failed: {str(e)}')
@@ -329,13 +227,67 @@ def analyze_company():
         security_manager.log_security_event('ANALYSIS_ERROR', f'Unexpected error: {str(e)}')
         return jsonify({'error': 'Internal server error'}), 500
 
-@due_diligence_bp.route('/health', methods=['GET'])
+@ai_route('/analyze-companies', methods=['POST'])
 @cross_origin()
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy', 
-        'service': 'due-diligence-api',
-        'security': 'enabled'
-    })
-
+@security_manager.rate_limit(max_requests=5, window_minutes=1)  # Lower limit for AI analysis
+def analyze_companies():
+    """Analyze a batch of companies with a single Gemini call"""
+    try:
+        symbols, analysis_type, error = parse_batch_request()
+        if error:
+            return error
+        
+        # Validate API keys
+        is_valid, message = security_manager.validate_api_key(FMP_API_KEY, 'Financial Modeling Prep')
+        if not is_valid:
+            return jsonify({'error': message}), 500
+        
+        companies = fetch_companies_data(symbols)
+        
+        if not companies:
+            return jsonify({'error': 'Unable to fetch company data'}), 404
+        
+        summaries = '\n\n'.join(
+            f"### {symbol}\n{_build_data_summary(symbol, company_data)}"
+            for symbol, company_data in companies.items()
+        )
+        
+        # Generate all analyses with one Gemini call
+        try:
+            messages = [
+                BATCH_SYSTEM_PROMPTS[analysis_type],
+                HumanMessage(content=f"Please analyze the following companies:\n\n{summaries}")
+            ]
+            
+            response = llm.invoke(messages)
+        except Exception as e:
+            security_manager.log_security_event('AI_ERROR', f'Gemini batch analysis failed: {str(e)}')
+            return jsonify({'error': 'AI analysis service temporarily unavailable'}), 503
+        
+        # A malformed or truncated reply still returns the fetched company data
+        analysis_error = None
+        try:
+            analyses = _parse_batch_analysis(response.content, companies)
+        except ValueError as e:
+            security_manager.log_security_event('AI_ERROR', f'Unparseable Gemini batch analysis: {str(e)}')
+            analyses = {}
+            analysis_error = 'AI analysis response could not be parsed'
+        
+        results = {
+            symbol: {
+                'analysis': analyses.get(symbol, ''),
+                'company_data': company_data
+            }
+            for symbol, company_data in companies.items()
+        }
+        
+        return json_response({
+            'results': results,
+            'unavailable': [symbol for symbol in symbols if symbol not in companies],
+            'analysis_type': analysis_type,
+            'analysis_error': analysis_error
+        })
+        
+    except Exception as e:
+        security_manager.log_security_event('ANALYSIS_ERROR', f'Unexpected error: {str(e)}')
+        return jsonify({'error': 'Internal server error'}), 500
@@ -6,80 +6,340 @@ import secrets
 import hashlib
 import hmac
 from functools import wraps
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, g
 import time
-from collections import defaultdict
+import random
+from collections import OrderedDict
+import queue
 import re
+import threading
+import atexit
+import logging
+import logging.handlers
+import sys
+from src.cache import redis, redis_client, redis_warning
+
+# Characters stripped by input sanitization, as str.translate deletion tables
+_CONTROL_CHARS_TABLE = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F])
+_SPECIAL_CHARS_TABLE = dict.fromkeys(map(ord, '<>"\';()&+'))
+
+# Patterns flagged by check_suspicious_activity
+_SUSPICIOUS_PATTERNS = (
+    r'<script',
+    r'javascript:',
+    r'on\w+\s*=',
+    r'eval\s*\(',
+    r'document\.',
+    r'window\.',
+    r'\.\./',
+    r'union\s+select',
+    r'drop\s+table',
+    r'insert\s+into',
+    r'delete\s+from'
+)
+
+# One case-insensitive alternation, one group per pattern, so input is scanned once
+_SUSPICIOUS_RE = re.compile('|'.join(f'({pattern})' for pattern in _SUSPICIOUS_PATTERNS), re.IGNORECASE)
+
+# Patterns that are plain literals can be found with a substring search in lowercased ASCII
+# input; the rest still need the regex
+_SUSPICIOUS_LITERALS = (
+    ('<script', r'<script'),
+    ('javascript:', r'javascript:'),
+    ('document.', r'document\.'),
+    ('window.', r'window\.'),
+    ('../', r'\.\./')
+)
+_SUSPICIOUS_REGEX_PATTERNS = tuple(
+    pattern for pattern in _SUSPICIOUS_PATTERNS
+    if pattern not in {pattern for _, pattern in _SUSPICIOUS_LITERALS}
+)
+_SUSPICIOUS_REGEX_RE = re.compile('|'.join(f'({pattern})' for pattern in _SUSPICIOUS_REGEX_PATTERNS), re.IGNORECASE)
+
+# Headers added to every response by secure_headers
+SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Strict-Transport-Security': 'max-age=31536000; includeSubDomains',
+    'Content-Security-Policy': "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'"
+}
+
+# Upper bound on remembered blocked IPs so rotating addresses can't grow memory without limit
+MAX_BLOCKED_IPS = 100_000
+
+# How long an IP stays blocked after hammering a rate limit
+BLOCK_SECONDS = 15 * 60
+
+# Number of rate-limit shards (a power of two, so a shard is picked with a bit mask)
+RATE_LIMIT_SHARDS = 16
+
+# Every suspicious pattern needs one of these characters (\s included), so ASCII input
+# without any of them can skip the regex scan
+_SUSPICIOUS_CANARIES = frozenset('<:=(. \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')
+
+def _sanitize(value, max_length, allow_special_chars):
+    """Strip control (and optionally special) characters and clamp length"""
+    # Limit length first so oversized payloads cost no more than max_length
+    cleaned = str(value)
+    if len(cleaned) > max_length:
+        cleaned = cleaned[:max_length]
+    
+    # Remove null bytes and control characters
+    cleaned = cleaned.translate(_CONTROL_CHARS_TABLE)
+    
+    # If special characters not allowed, remove them
+    if not allow_special_chars:
+        cleaned = cleaned.translate(_SPECIAL_CHARS_TABLE)
+    
+    return cleaned.strip()
+
+def _client_ip():
+    """Return the client IP for the current request, resolved once per request
+    
+    X-Forwarded-For is client-controlled, so it is never read here; behind trusted
+    proxies main.py applies ProxyFix, which sets remote_addr from it safely.
+    """
+    client_ip = g.get('client_ip')
+    if client_ip is None:
+        client_ip = request.remote_addr
+        g.client_ip = client_ip
+    return client_ip
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of stalling the request when the queue is full"""
+    
+    def prepare(self, record):
+        # The listener's writer builds the line from the record's extra fields, so skip
+        # QueueHandler's message formatting (and record copy) on the request thread
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+class _DedupFilter(logging.Filter):
+    """Coalesce repeated security events (e.g. an upstream outage) to one line per window"""
+    
+    def __init__(self, window=1.0, max_keys=10000):
+        super().__init__()
+        self._window = window
+        self._max_keys = max_keys
+        self._last_logged = OrderedDict()  # (event_type, client_ip, details) -> time, oldest first
+    
+    def filter(self, record):
+        details = getattr(record, 'details', None)
+        key = (
+            getattr(record, 'event_type', None),
+            getattr(record, 'client_ip', None),
+            record.getMessage() if details is None else details
+        )
+        
+        # Forget keys whose window has passed (entries are kept in the order they were logged)
+        last_logged = self._last_logged
+        while last_logged:
+            oldest_key, oldest_time = next(iter(last_logged.items()))
+            if record.created - oldest_time < self._window:
+                break
+            del last_logged[oldest_key]
+        
+        if key in last_logged:
+            return False
+        
+        last_logged[key] = record.created
+        if len(last_logged) > self._max_keys:
+            last_logged.popitem(last=False)
+        return True
+
+class _SecurityLogWriter(logging.Handler):
+    """Write each security event as one pre-joined line with a single stream write"""
+    
+    def __init__(self, stream):
+        super().__init__()
+        self._stream = stream
+        self._formatted_second = (None, '')  # (whole second, formatted timestamp)
+    
+    def emit(self, record):
+        try:
+            # Only reformat the timestamp when the second changes
+            second = int(record.created)
+            if self._formatted_second[0] != second:
+                self._formatted_second = (second, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second)))
+            
+            self._stream.write(''.join((
+                '[', self._formatted_second[1], '] SECURITY: ', record.event_type,
+                ' - IP: ', str(record.client_ip), ' - ', str(record.details), '\n'
+            )))
+            self._stream.flush()
+        except Exception:
+            self.handleError(record)
+
+def _start_security_logger():
+    """Route the 'security' logger through a queue to a background stdout writer"""
+    log_queue = queue.Queue(maxsize=10000)
+    
+    handler = _SecurityLogWriter(sys.stdout)
+    handler.addFilter(_DedupFilter())
+    
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger = logging.getLogger('security')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    return logger
+
+# Security events are written asynchronously so requests never block on log I/O
+security_logger = _start_security_logger()
 
 class SecurityManager:
     def __init__(self):
-        self.rate_limit_storage = defaultdict(list)
-        self.blocked_ips = set()
+        # Counters are sharded by IP so concurrent requests from different clients rarely share a lock
+        self.rate_limit_storage = [{} for _ in range(RATE_LIMIT_SHARDS)]  # (ip, route, window_seconds, window_id) -> request count
+        self.rate_limit_locks = [threading.Lock() for _ in range(RATE_LIMIT_SHARDS)]
+        self.blocked_ips = OrderedDict()  # ip -> block expiry, oldest block first
+        self.blocked_ips_lock = threading.Lock()
         
     def validate_input(self, input_string, max_length=1000, allow_special_chars=True):
         """Validate and sanitize user input"""
         if not input_string:
             return ""
         
-        # Remove null bytes and control characters
-        cleaned = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', str(input_string))
-        
-        # Limit length
-        if len(cleaned) > max_length:
-            cleaned = cleaned[:max_length]
-        
-        # If special characters not allowed, remove them
-        if not allow_special_chars:
-            cleaned = re.sub(r'[<>"\';()&+]', '', cleaned)
+        return _sanitize(input_string, max_length, allow_special_chars)
+    
+    def validate_batch(self, items, schema):
+        """Validate and sanitize the schema fields of many records in one pass
+
+        `schema` maps each field name to (max_length, allow_special_chars).
+        Fields are sanitized a column at a time so each policy is applied in one sweep.
+        """
+        results = [{} for _ in items]
+        for field, (max_length, allow_special_chars) in schema.items():
+            column = [str(value)[:max_length].translate(_CONTROL_CHARS_TABLE) if (value := item.get(field)) else "" for item in items]
+            if not allow_special_chars:
+                column = [value.translate(_SPECIAL_CHARS_TABLE) for value in column]
+            for safe_item, value in zip(results, column):
+                safe_item[field] = value.strip()
         
-        return cleaned.strip()
+        return results
     
     def validate_symbol(self, symbol):
         """Validate stock symbol format"""
         if not symbol:
             return False
         
-        # Stock symbols should be alphanumeric, 1-5 characters typically
-        pattern = r'^[A-Za-z0-9]{1,10}$'
-        return bool(re.match(pattern, symbol))
+        # Stock symbols should be alphanumeric, 1-5 characters typically (ASCII only, at most 10);
+        # together these checks accept exactly what [A-Za-z0-9]{1,10} would
+        return isinstance(symbol, str) and len(symbol) <= 10 and symbol.isascii() and symbol.isalnum()
     
     def rate_limit(self, max_requests=10, window_minutes=1):
         """Rate limiting decorator"""
+        window_seconds = window_minutes * 60
+        
         def decorator(f):
+            # Each decorated route counts only its own traffic against its own limit
+            route = f"{f.__module__}.{f.__qualname__}"
+            
             @wraps(f)
             def decorated_function(*args, **kwargs):
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+                client_ip = _client_ip()
                 
-                if client_ip in self.blocked_ips:
+                # Count requests in fixed windows; rejected attempts count too
+                blocked, count = self._check_request(client_ip, route, window_seconds)
+                if blocked:
                     return jsonify({'error': 'IP blocked due to abuse'}), 429
                 
-                current_time = time.time()
-                window_start = current_time - (window_minutes * 60)
-                
-                # Clean old requests
-                self.rate_limit_storage[client_ip] = [
-                    req_time for req_time in self.rate_limit_storage[client_ip]
-                    if req_time > window_start
-                ]
-                
                 # Check rate limit
-                if len(self.rate_limit_storage[client_ip]) >= max_requests:
+                if count > max_requests:
                     # Block IP if consistently hitting rate limits
-                    if len(self.rate_limit_storage[client_ip]) > max_requests * 2:
-                        self.blocked_ips.add(client_ip)
+                    if count > max_requests * 2:
+                        self.block_ip(client_ip)
                     
                     return jsonify({
                         'error': 'Rate limit exceeded',
-                        'retry_after': window_minutes * 60
+                        'retry_after': window_seconds
                     }), 429
                 
-                # Add current request
-                self.rate_limit_storage[client_ip].append(current_time)
-                
                 return f(*args, **kwargs)
             return decorated_function
         return decorator
     
+    def _check_request(self, client_ip, route, window_seconds):
+        """Return (blocked, count) for a request: whether the IP is blocked, and the new total
+        for the route in the client's current window (0 when blocked locally)"""
+        window_id = time.time_ns() // (window_seconds * 1_000_000_000)
+        
+        # Redis keeps blocks and counts shared across worker processes; one round trip for both
+        if redis_client is not None:
+            key = f"ddapi:rl:{route}:{window_seconds}:{client_ip}:{window_id}"
+            try:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.exists(f"ddapi:block:{client_ip}")
+                pipe.incr(key)
+                pipe.expire(key, window_seconds)
+                blocked, count, _ = pipe.execute()
+                return bool(blocked) or self._is_blocked_locally(client_ip), count
+            except redis.RedisError as e:
+                redis_warning(f"Redis rate limit failed, using local counters: {e}")
+        
+        if self._is_blocked_locally(client_ip):
+            return True, 0
+        
+        key = (client_ip, route, window_seconds, window_id)
+        shard = hash(client_ip) & (RATE_LIMIT_SHARDS - 1)
+        counters = self.rate_limit_storage[shard]
+        with self.rate_limit_locks[shard]:
+            count = counters.get(key, 0) + 1
+            counters[key] = count
+        
+        # Occasionally drop counters from past windows
+        if random.random() < 0.001:
+            self._prune_rate_limits()
+        
+        return False, count
+    
+    def _is_blocked_locally(self, client_ip):
+        """Return True if the IP is in the in-process blocklist (used when Redis is unavailable)"""
+        expires_at = self.blocked_ips.get(client_ip)
+        if expires_at is None:
+            return False
+        if expires_at > time.time():
+            return True
+        
+        with self.blocked_ips_lock:
+            self.blocked_ips.pop(client_ip, None)
+        return False
+    
+    def block_ip(self, client_ip):
+        """Block an IP for BLOCK_SECONDS, evicting the oldest blocks once MAX_BLOCKED_IPS is reached"""
+        # Redis shares the block (and its expiry) across worker processes
+        if redis_client is not None:
+            try:
+                redis_client.setex(f"ddapi:block:{client_ip}", BLOCK_SECONDS, 1)
+                return
+            except redis.RedisError as e:
+                redis_warning(f"Redis block failed, using local blocklist: {e}")
+        
+        with self.blocked_ips_lock:
+            self.blocked_ips.pop(client_ip, None)
+            self.blocked_ips[client_ip] = time.time() + BLOCK_SECONDS
+            if len(self.blocked_ips) > MAX_BLOCKED_IPS:
+                self.blocked_ips.popitem(last=False)
+    
+    def _prune_rate_limits(self):
+        """Drop rate-limit counters whose window has already ended"""
+        now_ns = time.time_ns()
+        for counters, lock in zip(self.rate_limit_storage, self.rate_limit_locks):
+            with lock:
+                for key in list(counters):
+                    _, _, window_seconds, window_id = key
+                    if window_id < now_ns // (window_seconds * 1_000_000_000):
+                        del counters[key]
+    
     def validate_api_key(self, api_key, service_name):
         """Validate API key format (basic validation)"""
         if not api_key or api_key.startswith('your_'):
@@ -93,44 +353,37 @@ class SecurityManager:
     
     def secure_headers(self, response):
         """Add security headers to response"""
-        response.headers['X-Content-Type-Options'] = 'nosniff'
-        response.headers['X-Frame-Options'] = 'DENY'
-        response.headers['X-XSS-Protection'] = '1; mode=block'
-        response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
-        response.headers['Content-Security-Policy'] = "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'"
+        response.headers.update(SECURITY_HEADERS)
         return response
     
     def log_security_event(self, event_type, details, client_ip=None):
-        """Log security events"""
+        """Log security events (written asynchronously by the security logger)"""
         if not client_ip:
-            client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+            client_ip = _client_ip()
         
-        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        log_entry = f"[{timestamp}] SECURITY: {event_type} - IP: {client_ip} - {details}"
-        
-        # In production, this should go to a proper logging system
-        print(log_entry)
+        security_logger.warning(
+            'SECURITY: %s - IP: %s - %s', event_type, client_ip, details,
+            extra={'event_type': event_type, 'client_ip': client_ip, 'details': details}
+        )
     
     def check_suspicious_activity(self, user_input):
         """Check for suspicious patterns in user input"""
-        suspicious_patterns = [
-            r'<script',
-            r'javascript:',
-            r'on\w+\s*=',
-            r'eval\s*\(',
-            r'document\.',
-            r'window\.',
-            r'\.\./',
-            r'union\s+select',
-            r'drop\s+table',
-            r'insert\s+into',
-            r'delete\s+from'
-        ]
-        
-        user_input_lower = user_input.lower()
-        for pattern in suspicious_patterns:
-            if re.search(pattern, user_input_lower):
-                return True, f"Suspicious pattern detected: {pattern}"
+        if not user_input.isascii():
+            # Unicode case folding and whitespace need the full regex
+            patterns, match = _SUSPICIOUS_PATTERNS, _SUSPICIOUS_RE.search(user_input)
+        else:
+            if _SUSPICIOUS_CANARIES.isdisjoint(user_input):
+                return False, "Clean"
+            
+            user_input_lower = user_input.lower()
+            for literal, pattern in _SUSPICIOUS_LITERALS:
+                if literal in user_input_lower:
+                    return True, f"Suspicious pattern detected: {pattern}"
+            
+            patterns, match = _SUSPICIOUS_REGEX_PATTERNS, _SUSPICIOUS_REGEX_RE.search(user_input)
+        
+        if match:
+            return True, f"Suspicious pattern detected: {patterns[match.lastindex - 1]}"
         
         return False, "Clean"
 
@@ -142,15 +395,15 @@ def require_valid_input(field_name, max_length=1000, allow_special_chars=True):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            data = request.get_json() if request.is_json else request.form
+            data = get_request_data()
             
             if field_name not in data:
                 return jsonify({'error': f'Missing required field: {field_name}'}), 400
             
             value = data[field_name]
             
-            # Check for suspicious activity
-            is_suspicious, reason = security_manager.check_suspicious_activity(str(value))
+            # Check for suspicious activity (only the part that survives truncation)
+            is_suspicious, reason = security_manager.check_suspicious_activity(str(value)[:max_length])
             if is_suspicious:
                 security_manager.log_security_event(
                     'SUSPICIOUS_INPUT',
@@ -163,17 +416,25 @@ def require_valid_input(field_name, max_length=1000, allow_special_chars=True):
                 value, max_length, allow_special_chars
             )
             
-            # Update request data with cleaned value
-            if request.is_json:
-                request.json[field_name] = cleaned_value
-            else:
-                request.form = request.form.copy()
-                request.form[field_name] = cleaned_value
+            # Stash the cleaned value for the view (read it back with get_clean)
+            g.setdefault('clean_input', {})[field_name] = cleaned_value
             
             return f(*args, **kwargs)
         return decorated_function
     return decorator
 
+def get_request_data():
+    """Return the JSON body (or form data) of the current request, parsed once per request"""
+    data = g.get('request_data')
+    if data is None:
+        data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+        g.request_data = data
+    return data
+
+def get_clean(field_name, default=None):
+    """Return a field value sanitized by require_valid_input for the current request"""
+    return g.get('clean_input', {}).get(field_name, default)
+
 def validate_symbol_input(f):
     """Decorator specifically for stock symbol validation"""
     @wraps(f)
@@ -183,7 +444,7 @@ def validate_symbol_input(f):
             symbol = kwargs['symbol']
         else:
             # Check in request data
-            data = request.get_json() if request.is_json else request.form
+            data = get_request_data()
             symbol = data.get('symbol', '')
         
         if not security_manager.validate_symbol(symbol):